@@ -6,92 +6,246 @@ collect_metrics.py - Aggregates benchmark JSON results into CSV format
 """
 
 import json
-import glob
 import csv
 import os
-import statistics
-from collections import defaultdict
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from fractions import Fraction
+from itertools import chain, islice
+from operator import itemgetter
 
+# orjson is optional; its JSONDecodeError subclasses json.JSONDecodeError,
+# so the except clauses below handle both parsers.
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 
-def load_results(results_dir: str) -> list[dict]:
-    """Load all JSON result files from the results directory."""
-    results = []
-    
-    for pattern in [f"{results_dir}/*.json", f"{results_dir}/**/*.json"]:
-        for filepath in glob.glob(pattern, recursive=True):
-            # Skip security scan files
-            if "trivy" in filepath or "sbom" in filepath or "security" in filepath:
+
+# Security scan output (trivy/syft) lives alongside the benchmark results
+SKIP_PREFIXES = ('trivy-', 'sbom-')
+SKIP_SUBSTR = ('trivy', 'sbom', 'security')
+
+
+def _iter_json(root: str):
+    """Yield every benchmark JSON file below root, visiting each once.
+
+    Security scan files and directories are filtered here so they are never
+    opened or sent to the worker pool.
+    """
+    try:
+        entries = os.scandir(root)
+    except FileNotFoundError:
+        # A missing results directory just means there is nothing to collect
+        return
+    with entries:
+        for entry in entries:
+            name = entry.name
+            # Hidden files and directories were never matched by the old glob
+            if name.startswith('.'):
                 continue
-            try:
-                with open(filepath, 'r') as f:
-                    data = json.load(f)
-                    
-                    # Flatten nested performance metrics
-                    flat = {
-                        'tool': data.get('tool'),
-                        'service': data.get('service'),
-                        'dockerfile_type': data.get('dockerfile_type'),
-                        'cache_scenario': data.get('cache_scenario'),
-                        'run_number': data.get('run_number'),
-                        'timestamp': data.get('timestamp'),
-                        'ci_system': data.get('ci_system'),
-                        'exit_code': data.get('exit_code', 0)
-                    }
-                    
-                    # Handle nested performance structure
-                    perf = data.get('performance', data)
-                    flat.update({
-                        'build_duration_seconds': perf.get('build_duration_seconds'),
-                        'cpu_percent': perf.get('cpu_percent', 0),
-                        'cpu_user_seconds': perf.get('cpu_user_seconds', 0),
-                        'cpu_system_seconds': perf.get('cpu_system_seconds', 0),
-                        'memory_peak_mb': perf.get('memory_peak_mb', 0),
-                        'image_size': perf.get('image_size'),
-                        'image_size_bytes': perf.get('image_size_bytes', 0),
-                        'cache_hits': perf.get('cache_hits', 0),
-                        'cache_total_steps': perf.get('cache_total_steps', 0),
-                        'cache_hit_ratio': perf.get('cache_hit_ratio', 0)
-                    })
-                    
-                    results.append(flat)
-                    
-            except (json.JSONDecodeError, KeyError) as e:
-                print(f"Warning: Could not parse {filepath}: {e}")
+            if entry.is_dir(follow_symlinks=False):
+                if not any(s in name for s in SKIP_SUBSTR):
+                    yield from _iter_json(entry.path)
+            elif name.endswith('.json') and not name.startswith(SKIP_PREFIXES):
+                yield entry.path
+
+
+def _read_bytes(filepath: str) -> bytes:
+    """Read a whole file with raw os.read() calls.
+
+    Result files are a few KB, so the first read normally returns everything
+    and the second one hits EOF; no stat() is needed to size the buffer.
+    """
+    chunks = []
+    fd = os.open(filepath, os.O_RDONLY)
+    try:
+        chunk = os.read(fd, 65536)
+        while chunk:
+            chunks.append(chunk)
+            chunk = os.read(fd, 65536)
+    finally:
+        os.close(fd)
+    return b''.join(chunks)
+
+
+def _read_batch(filepaths: list[str]) -> list[tuple[str, bytes]]:
+    """Read a batch of files, returning (path, contents) pairs."""
+    return [(f, _read_bytes(f)) for f in filepaths]
+
+
+# Flattened result schema. itemgetter pulls all keys in one C call for files
+# with the full schema; _parse_bytes falls back to .get() with these defaults.
+DATA_DEFAULTS = {
+    'tool': None,
+    'service': None,
+    'dockerfile_type': None,
+    'cache_scenario': None,
+    'run_number': None,
+    'timestamp': None,
+    'ci_system': None,
+    'exit_code': 0,
+}
+PERF_DEFAULTS = {
+    'build_duration_seconds': None,
+    'cpu_percent': 0,
+    'cpu_user_seconds': 0,
+    'cpu_system_seconds': 0,
+    'memory_peak_mb': 0,
+    'image_size': None,
+    'image_size_bytes': 0,
+    'cache_hits': 0,
+    'cache_total_steps': 0,
+    'cache_hit_ratio': 0,
+}
+_get_data = itemgetter(*DATA_DEFAULTS)
+_get_perf = itemgetter(*PERF_DEFAULTS)
+
+
+def _parse_bytes(item: tuple[str, bytes]) -> dict | None:
+    """Parse and flatten the contents of a single JSON result file."""
+    filepath, raw = item
+    try:
+        data = json_loads(raw)
+        
+        # Handle nested performance structure
+        perf = data.get('performance', data)
+        
+        # Flatten nested performance metrics
+        try:
+            flat = dict(zip(DATA_DEFAULTS, _get_data(data)))
+            flat.update(zip(PERF_DEFAULTS, _get_perf(perf)))
+        except KeyError:
+            flat = {k: data.get(k, d) for k, d in DATA_DEFAULTS.items()}
+            flat.update((k, perf.get(k, d)) for k, d in PERF_DEFAULTS.items())
+        
+        return flat
+            
+    except (json.JSONDecodeError, KeyError) as e:
+        print(f"Warning: Could not parse {filepath}: {e}")
+    return None
+
+
+def _parse_batch(items: list[tuple[str, bytes]]) -> list[dict]:
+    """Parse a batch of files, dropping the ones that could not be parsed."""
+    return [r for r in map(_parse_bytes, items) if r]
+
+
+# Files per read/parse task, and tasks in flight at each pipeline stage.
+# Batching keeps pickling and scheduling overhead per task small; the depth
+# bounds memory to a fixed window of files.
+BATCH_SIZE = 64
+PIPELINE_DEPTH = 16
+
+
+def iter_results(results_dir: str) -> Iterator[dict]:
+    """Yield flattened results from the results directory as they are parsed."""
+    files = _iter_json(results_dir)
+    batches = iter(lambda: list(islice(files, BATCH_SIZE)), [])
     
-    return results
+    # Reads are I/O-bound and go to threads; parsing is CPU-bound and goes to
+    # processes. At most PIPELINE_DEPTH batches are read and parsed at once,
+    # and each parse is submitted as soon as its read completes, so reading,
+    # parsing and the caller's CSV writes overlap without buffering every file.
+    with ThreadPoolExecutor(PIPELINE_DEPTH) as tp, ProcessPoolExecutor() as pp:
+        reads = deque(tp.submit(_read_batch, b) for b in islice(batches, PIPELINE_DEPTH))
+        parses = deque()
+        while reads or parses:
+            if reads:
+                parses.append(pp.submit(_parse_batch, reads.popleft().result()))
+                for b in islice(batches, 1):
+                    reads.append(tp.submit(_read_batch, b))
+            if len(parses) >= PIPELINE_DEPTH or not reads:
+                yield from parses.popleft().result()
 
 
-def export_to_csv(results: list[dict], output_path: str):
-    """Export results to CSV format."""
-    if not results:
-        print("No results to export")
-        return
+CSV_FIELDNAMES = (
+    'tool', 'service', 'dockerfile_type', 'cache_scenario', 'run_number',
+    'timestamp', 'ci_system', 'build_duration_seconds',
+    'cpu_percent', 'cpu_user_seconds', 'cpu_system_seconds',
+    'memory_peak_mb', 'image_size', 'image_size_bytes',
+    'cache_hits', 'cache_total_steps', 'cache_hit_ratio', 'exit_code'
+)
+# Every flattened result carries all CSV_FIELDNAMES, so rows can be pulled
+# out positionally and written with a plain csv.writer
+_get_row = itemgetter(*CSV_FIELDNAMES)
+
+
+def export_to_csv(results: Iterable[dict], output_path: str) -> int:
+    """Stream results to CSV format and return the number of rows written.
+
+    Nothing is written when there are no results; the caller reports that.
+    """
+    results = iter(results)
+    first = next(results, None)
+    if first is None:
+        return 0
+    
+    count = 0
     
-    fieldnames = [
-        'tool', 'service', 'dockerfile_type', 'cache_scenario', 'run_number',
-        'timestamp', 'ci_system', 'build_duration_seconds',
-        'cpu_percent', 'cpu_user_seconds', 'cpu_system_seconds',
-        'memory_peak_mb', 'image_size', 'image_size_bytes',
-        'cache_hits', 'cache_total_steps', 'cache_hit_ratio', 'exit_code'
-    ]
+    def rows():
+        nonlocal count
+        for r in chain((first,), results):
+            count += 1
+            yield _get_row(r)
     
     with open(output_path, 'w', newline='') as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction='ignore')
-        writer.writeheader()
-        writer.writerows(results)
+        writer = csv.writer(f)
+        writer.writerow(CSV_FIELDNAMES)
+        writer.writerows(rows())
     
-    print(f"Exported {len(results)} results to {output_path}")
+    print(f"Exported {count} results to {output_path}")
+    return count
 
 
-def print_summary(results: list[dict]):
-    """Print summary statistics to console."""
-    groups = defaultdict(list)
+SUMMARY_METRICS = ('build_duration_seconds', 'cpu_percent', 'memory_peak_mb', 'cache_hit_ratio')
+_get_summary_key = itemgetter('tool', 'service', 'dockerfile_type', 'cache_scenario')
+
+
+class RunningMeans:
+    """Running means of SUMMARY_METRICS for one group; zero readings are skipped.
+
+    Sums are kept as Fractions, so the means are exact like statistics.mean.
+    """
+    
+    __slots__ = ('n', 'sums', 'counts')
+    
+    def __init__(self):
+        self.n = 0
+        self.sums = [Fraction(0)] * len(SUMMARY_METRICS)
+        self.counts = [0] * len(SUMMARY_METRICS)
+    
+    def add(self, r: dict):
+        self.n += 1
+        for i, metric in enumerate(SUMMARY_METRICS):
+            value = r.get(metric)
+            if value:
+                self.sums[i] += Fraction(value)
+                self.counts[i] += 1
     
+    def means(self) -> list[float]:
+        return [float(s / c) if c else 0 for s, c in zip(self.sums, self.counts)]
+
+
+def summarize(results: Iterable[dict], groups: dict) -> Iterator[dict]:
+    """Pass results through unchanged while accumulating RunningMeans into groups.
+
+    Only the first key tuple seen for a group is stored; per-row keys are
+    used for the lookup and dropped straight away.
+    """
     for r in results:
         if r.get('build_duration_seconds') is not None:
-            key = (r['tool'], r['service'], r['dockerfile_type'], r['cache_scenario'])
-            groups[key].append(r)
-    
+            key = _get_summary_key(r)
+            stats = groups.get(key)
+            if stats is None:
+                stats = groups[key] = RunningMeans()
+            stats.add(r)
+        yield r
+
+
+def print_summary(groups: dict):
+    """Print summary statistics to console."""
     print("\n" + "=" * 100)
     print("BENCHMARK SUMMARY")
     print("=" * 100)
@@ -100,20 +254,11 @@ def print_summary(results: list[dict]):
     print(header)
     print("-" * 100)
     
-    for key, runs in sorted(groups.items()):
+    for key, stats in sorted(groups.items()):
         tool, service, dtype, scenario = key
+        mean_dur, mean_cpu, mean_mem, mean_cache = stats.means()
         
-        durations = [r['build_duration_seconds'] for r in runs if r['build_duration_seconds']]
-        cpu = [r['cpu_percent'] for r in runs if r.get('cpu_percent')]
-        mem = [r['memory_peak_mb'] for r in runs if r.get('memory_peak_mb')]
-        cache = [r['cache_hit_ratio'] for r in runs if r.get('cache_hit_ratio')]
-        
-        mean_dur = statistics.mean(durations) if durations else 0
-        mean_cpu = statistics.mean(cpu) if cpu else 0
-        mean_mem = statistics.mean(mem) if mem else 0
-        mean_cache = statistics.mean(cache) if cache else 0
-        
-        print(f"{tool:<10} {service:<15} {dtype:<10} {scenario:<8} {mean_dur:<12.2f} {mean_cpu:<8.1f} {mean_mem:<10.1f} {mean_cache:<8.4f} {len(runs)}")
+        print(f"{tool:<10} {service:<15} {dtype:<10} {scenario:<8} {mean_dur:<12.2f} {mean_cpu:<8.1f} {mean_mem:<10.1f} {mean_cache:<8.4f} {stats.n}")
 
 
 def main():
@@ -121,19 +266,15 @@ def main():
     output_csv = os.environ.get('OUTPUT_CSV', f'{results_dir}/benchmark_results.csv')
     
     print(f"Loading results from: {results_dir}")
-    results = load_results(results_dir)
     
-    if not results:
+    # Stream parsed results straight to CSV, collecting summary stats on the way
+    groups = {}
+    if not export_to_csv(summarize(iter_results(results_dir), groups), output_csv):
         print("No benchmark results found!")
         return
     
-    print(f"Loaded {len(results)} result files")
-    
-    # Export to CSV
-    export_to_csv(results, output_csv)
-    
     # Print summary
-    print_summary(results)
+    print_summary(groups)
 
 
 if __name__ == '__main__':
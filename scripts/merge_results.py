@@ -3,91 +3,231 @@
 Merge all benchmark JSON results into a single CSV for analysis.
 """
 
-import json
 import os
-import glob
+import pickle
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+from operator import itemgetter
 from pathlib import Path
 
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+# Result directories and how many subdirectory levels below each one the
+# JSON files live (results-github/<run>/*.json vs. results/*.json)
+SEARCH_DIRS = {
+    'results-github': 1,
+    'results-gitlab': 1,
+    'results-gitlab-public': 1,
+    'results': 0,
+    'final-results': 0,
+    'results-kaniko-selfhosted': 1,
+}
+
+# Security scan output (trivy, sbom) shares the result directories
+SKIP_PREFIXES = ('trivy-', 'sbom-')
+
+# Parsed rows from earlier runs, keyed by path and (mtime_ns, size) so
+# unchanged files are not reparsed. Rows are kept as the plain tuples
+# load_json_file returns, so the DataFrame is built the same way with or
+# without a cache and its dtypes never depend on earlier runs.
+CACHE_FILE = '.merge_cache.pickle'
+
+# Files handed to each worker and parsed with a single json_loads call
+BATCH_SIZE = 32
+
+def _scan_results(path, depth):
+    """Yield (path, stat) for result files `depth` directory levels below path."""
+    try:
+        entries = os.scandir(path)
+    except FileNotFoundError:
+        return
+    with entries:
+        for entry in entries:
+            name = entry.name
+            # Hidden entries (.ipynb_checkpoints, editor backups) were never
+            # matched by the old glob patterns; symlinks are followed as glob did
+            if name.startswith('.'):
+                continue
+            if entry.is_dir():
+                if depth:
+                    yield from _scan_results(entry.path, depth - 1)
+            elif depth == 0 and name.endswith('.json'):
+                if name.startswith(SKIP_PREFIXES) or 'benchmark' in name.lower():
+                    continue
+                yield entry.path, entry.stat()
+
+def iter_result_files(base_dir):
+    """Yield (path, stat) for the result JSON files under SEARCH_DIRS in a single walk.
+
+    Security scans and aggregate benchmark files are skipped here so they
+    are never opened. The stat comes from the directory scan.
+    """
+    with os.scandir(base_dir) as entries:
+        for entry in entries:
+            if entry.name in SEARCH_DIRS and entry.is_dir():
+                yield from _scan_results(entry.path, SEARCH_DIRS[entry.name])
+
+# Column order of the merged CSV; load_json_file returns rows in this order
+FIELDNAMES = (
+    'tool', 'service', 'dockerfile_type', 'cache_scenario', 'run_number',
+    'timestamp', 'ci_system', 'build_duration_seconds',
+    'cpu_percent', 'cpu_user_seconds', 'cpu_system_seconds',
+    'memory_peak_mb', 'image_size', 'image_size_bytes',
+    'cache_hits', 'cache_total_steps', 'cache_hit_ratio', 'exit_code',
+    'source_file',
+)
+
+# Values used when a result file lacks a field
+FIELD_DEFAULTS = dict.fromkeys(FIELDNAMES, 0) | dict.fromkeys(
+    ('tool', 'service', 'dockerfile_type', 'cache_scenario', 'timestamp',
+     'ci_system', 'image_size', 'source_file'), ''
+)
+
+# Top-level and performance.* fields, in FIELDNAMES order. itemgetter pulls
+# them in one C call when a file has the full schema.
+DATA_KEYS = FIELDNAMES[:7]
+PERF_KEYS = FIELDNAMES[7:17]
+_get_data = itemgetter(*DATA_KEYS)
+_get_perf = itemgetter(*PERF_KEYS)
+
+# Low-cardinality identifier columns used as group-by and sort keys
+GROUP_KEYS = ('ci_system', 'tool', 'service', 'dockerfile_type', 'cache_scenario')
+
+def flatten_record(data, filepath):
+    """Flatten one parsed result document into a FIELDNAMES row."""
+    perf = data.get('performance', {})
+    try:
+        row = _get_data(data) + _get_perf(perf) + (data['exit_code'],)
+    except KeyError:
+        row = (
+            tuple(data.get(k, FIELD_DEFAULTS[k]) for k in DATA_KEYS)
+            + tuple(perf.get(k, FIELD_DEFAULTS[k]) for k in PERF_KEYS)
+            + (data.get('exit_code', 0),)
+        )
+    return row + (os.path.basename(filepath),)
+
 def load_json_file(filepath):
-    """Load a single JSON result file and flatten it."""
+    """Load a single JSON result file and flatten it into a FIELDNAMES row."""
     try:
-        with open(filepath, 'r') as f:
-            data = json.load(f)
-        
-        # Flatten nested performance dict
-        flat = {
-            'tool': data.get('tool', ''),
-            'service': data.get('service', ''),
-            'dockerfile_type': data.get('dockerfile_type', ''),
-            'cache_scenario': data.get('cache_scenario', ''),
-            'run_number': data.get('run_number', 0),
-            'timestamp': data.get('timestamp', ''),
-            'ci_system': data.get('ci_system', ''),
-        }
-        
-        # Add performance metrics
-        perf = data.get('performance', {})
-        flat['build_duration_seconds'] = perf.get('build_duration_seconds', 0)
-        flat['cpu_percent'] = perf.get('cpu_percent', 0)
-        flat['cpu_user_seconds'] = perf.get('cpu_user_seconds', 0)
-        flat['cpu_system_seconds'] = perf.get('cpu_system_seconds', 0)
-        flat['memory_peak_mb'] = perf.get('memory_peak_mb', 0)
-        flat['image_size'] = perf.get('image_size', '')
-        flat['image_size_bytes'] = perf.get('image_size_bytes', 0)
-        flat['cache_hits'] = perf.get('cache_hits', 0)
-        flat['cache_total_steps'] = perf.get('cache_total_steps', 0)
-        flat['cache_hit_ratio'] = perf.get('cache_hit_ratio', 0)
-        flat['exit_code'] = data.get('exit_code', 0)
-        flat['source_file'] = os.path.basename(filepath)
-        
-        return flat
+        with open(filepath, 'rb') as f:
+            data = json_loads(f.read())
+        return flatten_record(data, filepath)
     except Exception as e:
         print(f"Error loading {filepath}: {e}")
         return None
 
+def load_json_batch(filepaths):
+    """Load and flatten a batch of result files with a single parse call.
+
+    The raw files are joined into one JSON array so the parser is entered
+    once per batch. If that fails (or a file does not hold exactly one
+    document) the batch falls back to load_json_file, which reports the
+    offending file.
+    """
+    try:
+        raw = []
+        for filepath in filepaths:
+            with open(filepath, 'rb') as f:
+                raw.append(f.read())
+        docs = json_loads(b'[' + b','.join(raw) + b']')
+        if len(docs) != len(filepaths):
+            raise ValueError('batch misaligned')
+        return [flatten_record(data, path) for data, path in zip(docs, filepaths)]
+    except Exception:
+        return [load_json_file(path) for path in filepaths]
+
+def load_cache(cache_file):
+    """Return {path: ((mtime_ns, size), row)} from a previous run, or {}."""
+    try:
+        with open(cache_file, 'rb') as f:
+            fields, rows = pickle.load(f)
+    except Exception:
+        # Missing, truncated or foreign cache files just mean a full reparse
+        return {}
+    return rows if fields == FIELDNAMES else {}
+
+def save_cache(rows, cache_file):
+    """Persist parsed rows for the next run."""
+    tmp = f'{cache_file}.tmp'
+    try:
+        with open(tmp, 'wb') as f:
+            pickle.dump((FIELDNAMES, rows), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, cache_file)
+    except OSError as e:
+        # The cache is only an optimisation; the next run reparses everything
+        print(f"Warning: not caching parsed results: {e}")
+
+def load_records(base_dir, cache_file=CACHE_FILE):
+    """Load all result rows, reparsing only files changed since the last run.
+
+    Returns a DataFrame with FIELDNAMES columns, or None if nothing was found.
+    """
+    file_keys = {}
+    for filepath, st in iter_result_files(base_dir):
+        file_keys[os.path.abspath(filepath)] = (st.st_mtime_ns, st.st_size)
+    
+    # Reuse cached rows whose file still has the same mtime and size
+    cached = load_cache(cache_file)
+    paths = sorted(file_keys)
+    todo = [path for path in paths if cached.get(path, (None,))[0] != file_keys[path]]
+    
+    parsed = {}
+    if todo:
+        # Parse batches in parallel; JSON decoding is CPU-bound
+        batches = [todo[i:i + BATCH_SIZE] for i in range(0, len(todo), BATCH_SIZE)]
+        with ProcessPoolExecutor() as ex:
+            parsed = dict(zip(todo, chain.from_iterable(ex.map(load_json_batch, batches))))
+    
+    # Rows are always assembled in path order, so the result is the same
+    # whichever of them came from the cache. Unparseable files are not
+    # cached and are reported again on the next run.
+    entries = {}
+    for path in paths:
+        row = parsed[path] if path in parsed else cached[path][1]
+        if row:
+            entries[path] = (file_keys[path], row)
+    if todo or entries.keys() != cached.keys():
+        save_cache(entries, cache_file)
+    
+    if not entries:
+        return None
+    
+    # Transpose rows into per-column lists so pandas gets the columns directly
+    rows = [row for _, row in entries.values()]
+    cols = dict(zip(FIELDNAMES, map(list, zip(*rows))))
+    return pd.DataFrame(cols, copy=False)
+
 def main():
     # Find all result directories
     base_dir = Path('.')
     
-    # Look for results in multiple locations
-    search_paths = [
-        'results-github/*/*.json',           
-        'results-gitlab/*/*.json',           
-        'results-gitlab-public/*/*.json',  
-        'results/*.json',
-        'final-results/*.json',
-        'results-kaniko-selfhosted/*/*.json',
-    ]
-    
-    all_records = []
-    
-    for pattern in search_paths:
-        json_files = glob.glob(pattern)
-        for filepath in json_files:
-            # Skip security scan files (trivy, sbom)
-            basename = os.path.basename(filepath)
-            if basename.startswith('trivy-') or basename.startswith('sbom-'):
-                continue
-            if 'benchmark' in basename.lower():
-                continue
-                
-            record = load_json_file(filepath)
-            if record:
-                all_records.append(record)
+    df = load_records(base_dir)
     
-    if not all_records:
+    if df is None:
         print("No JSON result files found!")
-        print("Searched in:", search_paths)
+        print("Searched in:", list(SEARCH_DIRS))
         return
     
-    # Create DataFrame
-    df = pd.DataFrame(all_records)
+    # Key columns are low-cardinality; categorical codes make grouping and
+    # sorting integer operations (categories are sorted, so order is unchanged)
+    for c in GROUP_KEYS:
+        df[c] = df[c].astype('category')
     
-    # Sort by tool, service, dockerfile_type, cache_scenario, run_number
-    df = df.sort_values(['ci_system', 'tool', 'service', 'dockerfile_type', 'cache_scenario', 'run_number'])
+    # Sort by tool, service, dockerfile_type, cache_scenario, run_number.
+    # Discovery order depends on the cache and worker pool, so this keeps the
+    # CSV deterministic; the keys are categorical, so it compares int codes.
+    df = df.sort_values(
+        ['ci_system', 'tool', 'service', 'dockerfile_type', 'cache_scenario', 'run_number'],
+        kind='stable', ignore_index=True,
+    )
     
-    # Save merged CSV
+    # Save merged CSV. This stays on DataFrame.to_csv rather than
+    # pyarrow.csv.write_csv: pyarrow quotes every string and writes integral
+    # floats without ".0", so the file would no longer be byte-identical.
     output_file = 'all_benchmark_results.csv'
     df.to_csv(output_file, index=False)
     print(f"\n Merged {len(df)} records into {output_file}")
@@ -106,18 +246,28 @@ def main():
     print("COMPREHENSIVE STATISTICS BY TOOL & CACHE SCENARIO")
     print("="*80)
     
+    # Aggregate every per-scenario metric in a single groupby pass; the
+    # tables below are column slices of this frame
+    scenario_stats = df.groupby(['ci_system', 'tool', 'cache_scenario'], observed=True).agg({
+        'build_duration_seconds': ['mean', 'std', 'min', 'max', 'count'],
+        'memory_peak_mb': ['mean', 'std', 'min', 'max'],
+        'cpu_percent': ['mean', 'std', 'min', 'max'],
+        'cache_hit_ratio': ['mean', 'std', 'min', 'max'],
+        'cache_hits': ['mean'],
+        'cache_total_steps': ['mean'],
+        'image_size_bytes': ['first'],
+    })
+    
     # Build Duration Statistics
     print("\n BUILD DURATION (seconds)")
     print("-"*60)
-    duration_stats = df.groupby(['ci_system', 'tool', 'cache_scenario']).agg({
-        'build_duration_seconds': ['mean', 'std', 'min', 'max', 'count']
-    }).round(2)
+    duration_stats = scenario_stats[['build_duration_seconds']].round(2)
     print(duration_stats.to_string())
     
     # Image Size Statistics (by tool and dockerfile type)
     print("\n IMAGE SIZE (bytes)")
     print("-"*60)
-    size_stats = df.groupby(['tool', 'service', 'dockerfile_type']).agg({
+    size_stats = df.groupby(['tool', 'service', 'dockerfile_type'], observed=True).agg({
         'image_size_bytes': ['mean', 'min', 'max']
     }).round(0)
     print(size_stats.to_string())
@@ -125,27 +275,19 @@ def main():
     # Memory Statistics
     print("\n PEAK MEMORY USAGE (MB)")
     print("-"*60)
-    mem_stats = df.groupby(['ci_system', 'tool', 'cache_scenario']).agg({
-        'memory_peak_mb': ['mean', 'std', 'min', 'max']
-    }).round(2)
+    mem_stats = scenario_stats[['memory_peak_mb']].round(2)
     print(mem_stats.to_string())
     
     # CPU Statistics
     print("\n CPU USAGE (%)")
     print("-"*60)
-    cpu_stats = df.groupby(['ci_system', 'tool', 'cache_scenario']).agg({
-        'cpu_percent': ['mean', 'std', 'min', 'max']
-    }).round(2)
+    cpu_stats = scenario_stats[['cpu_percent']].round(2)
     print(cpu_stats.to_string())
     
     # Cache Hit Ratio Statistics
     print("\n CACHE HIT RATIO")
     print("-"*60)
-    cache_stats = df.groupby(['ci_system', 'tool', 'cache_scenario']).agg({
-        'cache_hit_ratio': ['mean', 'std', 'min', 'max'],
-        'cache_hits': ['mean'],
-        'cache_total_steps': ['mean']
-    }).round(4)
+    cache_stats = scenario_stats[['cache_hit_ratio', 'cache_hits', 'cache_total_steps']].round(4)
     print(cache_stats.to_string())
     
     # Save all statistics to separate CSV files
@@ -160,13 +302,13 @@ def main():
     print("SUMMARY TABLE (for thesis)")
     print("="*80)
     
-    summary = df.groupby(['ci_system', 'tool', 'cache_scenario']).agg({
-        'build_duration_seconds': 'mean',
-        'memory_peak_mb': 'mean',
-        'cpu_percent': 'mean',
-        'image_size_bytes': 'first',
-        'cache_hit_ratio': 'mean'
-    }).round(2)
+    summary = scenario_stats[[
+        ('build_duration_seconds', 'mean'),
+        ('memory_peak_mb', 'mean'),
+        ('cpu_percent', 'mean'),
+        ('image_size_bytes', 'first'),
+        ('cache_hit_ratio', 'mean')
+    ]].round(2)
     summary.columns = ['Duration (s)', 'Memory (MB)', 'CPU (%)', 'Image Size (bytes)', 'Cache Hit Ratio']
     print(summary.to_string())
     summary.to_csv('thesis_summary_table.csv')
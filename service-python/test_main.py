@@ -1,16 +1,34 @@
+import httpx
+import pytest
 from fastapi.testclient import TestClient
 from main import app
 
-client = TestClient(app)
+# Synchronous client kept for callers that can't use the async fixture
+sync_client = TestClient(app)
 
 
-def test_read_root_status():
+@pytest.fixture(scope="session")
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(scope="session")
+async def client():
+    """One AsyncClient talking to the app in-process for the whole session"""
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
+        yield c
+
+
+@pytest.mark.anyio
+async def test_read_root_status(client):
     """Test that root endpoint returns 200 OK"""
-    response = client.get("/")
+    response = await client.get("/")
     assert response.status_code == 200
 
 
-def test_read_root_content():
+@pytest.mark.anyio
+async def test_read_root_content(client):
     """Test that root endpoint returns correct JSON"""
-    response = client.get("/")
+    response = await client.get("/")
     assert response.json() == {"Hello": "Python"}